@@ -7,25 +7,23 @@ Run with: .venv/bin/python3.12 fix_missing_titles.py
 """
 
 import logging
-import os
-import re
-import shutil
-import tempfile
-from pathlib import Path
+
+import orjson
 
 # Module-level imports from main script bring in the certifi monkey-patch
 # and shared helpers — intentional.
 from instapaper_to_remarkable import (
     INSTAPAPER_API,
-    _get_rm_device_token,
+    _H1_OPEN,
     article_to_pdf,
+    connect_remarkable,
+    extract_content,
     fetch_html,
     instapaper_auth,
     load_config,
     load_processed,
     sanitize_filename,
 )
-import trafilatura
 
 logging.basicConfig(
     level=logging.INFO,
@@ -45,7 +43,7 @@ def fetch_instapaper_bookmarks(session):
         if resp.status_code != 200:
             log.warning("Could not fetch folder '%s' (%s)", folder, resp.status_code)
             continue
-        items = [b for b in resp.json() if b.get("type") == "bookmark"]
+        items = [b for b in orjson.loads(resp.content) if b.get("type") == "bookmark"]
         for item in items:
             bid = str(item["bookmark_id"])
             result[bid] = {"title": item.get("title", ""), "url": item.get("url", "")}
@@ -58,10 +56,10 @@ def has_title_heading(url):
     html = fetch_html(url)
     if not html:
         return None  # couldn't fetch — unknown
-    content = trafilatura.extract(html, output_format="html", include_formatting=True)
+    content = extract_content(html, include_images=False)
     if not content:
         return None
-    return bool(re.search(r"<h1[\s>]", content, re.IGNORECASE))
+    return bool(_H1_OPEN.search(content))
 
 
 def find_doc(folder_docs, title):
@@ -104,28 +102,13 @@ def main():
     )
 
     log.info("Connecting to Remarkable...")
-    from rm_api import API
     from rm_api.models import Document
 
-    logging.getLogger("rm_api").setLevel(logging.ERROR)
-    token_file = Path.home() / ".rm_api_device_token"
-    token_file.write_text(_get_rm_device_token())
-    api = API(
-        token_file_path=str(token_file),
-        sync_file_path=str(Path.home() / ".rm_api_sync"),
-        log_file=os.devnull,
-    )
-    api.get_documents()
-
     folder_name = config["remarkable_folder"].strip("/")
-    target_folder = next(
-        (c for c in api.document_collections.values()
-         if c.metadata.visible_name == folder_name and not c.metadata.parent),
-        None,
-    )
-    if target_folder is None:
-        log.error("Remarkable folder /%s not found — aborting.", folder_name)
-        return
+    conn = connect_remarkable(config["remarkable_folder"], create=False)
+    if conn is None:
+        return  # connect_remarkable already logged why
+    api, target_folder = conn
 
     folder_docs = {
         uuid: doc for uuid, doc in api.documents.items()
@@ -170,41 +153,36 @@ def main():
         return
 
     # --- Update ---
-    tmpdir = tempfile.mkdtemp(prefix="instapaper_fix_")
     updated = 0
     failed = 0
-    try:
-        for bid, bookmark, old_doc in needs_update:
-            title = bookmark["title"]
-            url = bookmark["url"]
-            log.info("Updating: %s", title)
-
-            pdf_path = Path(tmpdir) / (sanitize_filename(title) + ".pdf")
-            try:
-                if not article_to_pdf(title, url, str(pdf_path)):
-                    log.warning("Could not regenerate PDF — skipping: %s", title)
-                    failed += 1
-                    continue
-
-                # Upload new version first (safer — old doc untouched if this fails)
-                pdf_bytes = pdf_path.read_bytes()
-                new_doc = Document.new_pdf(
-                    api=api, name=title, pdf_data=pdf_bytes,
-                    parent=target_folder.uuid,
-                )
-                api.upload(new_doc)
-                log.info("  Uploaded new version")
-
-                # Only delete old doc once new one is confirmed uploaded
-                api.delete(old_doc)
-                log.info("  Deleted old version")
-
-                updated += 1
-            except Exception:
-                log.exception("Error updating: %s", title)
+    for bid, bookmark, old_doc in needs_update:
+        title = bookmark["title"]
+        url = bookmark["url"]
+        log.info("Updating: %s", title)
+
+        try:
+            pdf_bytes = article_to_pdf(title, url, engine=config["pdf_engine"])
+            if not pdf_bytes:
+                log.warning("Could not regenerate PDF — skipping: %s", title)
                 failed += 1
-    finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+                continue
+
+            # Upload new version first (safer — old doc untouched if this fails)
+            new_doc = Document.new_pdf(
+                api=api, name=title, pdf_data=pdf_bytes,
+                parent=target_folder.uuid,
+            )
+            api.upload(new_doc)
+            log.info("  Uploaded new version")
+
+            # Only delete old doc once new one is confirmed uploaded
+            api.delete(old_doc)
+            log.info("  Deleted old version")
+
+            updated += 1
+        except Exception:
+            log.exception("Error updating: %s", title)
+            failed += 1
 
     log.info("Done. Updated: %d, failed: %d", updated, failed)
 
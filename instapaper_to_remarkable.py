@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 """Fetch unread Instapaper bookmarks, convert to PDF, upload to Remarkable."""
 
+import hashlib
 import html as html_lib
-import json
+import io
 import logging
+import mimetypes
 import os
+import queue
 import re
 import shutil
+import signal
 import socket
+import subprocess
 import sys
 import tempfile
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from http.cookiejar import MozillaCookieJar
 from urllib.parse import urlparse
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 # If a custom CA bundle is present (e.g. Zscaler SSL interception), use it
@@ -24,11 +32,21 @@ if _zscaler_certs.is_file():
 
     certifi.where = lambda: str(_zscaler_certs)
 
+import orjson
 import requests
 import trafilatura
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1Session
-from weasyprint import HTML
+from urllib3.util.retry import Retry
+from weasyprint import CSS, HTML, default_url_fetcher
+from weasyprint.text.fonts import FontConfiguration
+
+# Optional Rust port of trafilatura: faster and cleaner on typical articles.
+try:
+    from rs_trafilatura import extract as rs_extract
+except ImportError:
+    rs_extract = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -38,6 +56,25 @@ log = logging.getLogger(__name__)
 
 INSTAPAPER_API = "https://www.instapaper.com"
 
+# Fetch + extract + render is independent per article, so run it across cores.
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+# Article downloads are pure network wait, so fetch them all up front.
+MAX_FETCHES = 16
+
+CACHE_DIR = Path("~/.cache/instapaper_to_remarkable").expanduser()
+IMAGE_CACHE_DIR = CACHE_DIR / "images"
+IMAGE_CACHE_MAX_BYTES = 500 * 1024**2
+# Rendered PDFs are kept until uploaded; re-render ones older than this.
+PDF_CACHE_MAX_AGE = 7 * 24 * 3600
+# Give up on an article (slow origin, huge image) after this many seconds;
+# it's retried on the next run.
+ARTICLE_TIMEOUT = 60
+
+# "weasyprint" (default), a native renderer, or "auto" to use the first
+# native one found on PATH and fall back to WeasyPrint.
+PDF_ENGINES = ("weasyprint", "auto", "chromium", "wkhtmltopdf")
+_CHROMIUM_NAMES = ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable")
+
 EREADER_CSS = """\
 @page {
     size: A5;
@@ -59,18 +96,16 @@ pre, code { font-size: 9pt; overflow-wrap: break-word; }
 blockquote { border-left: 2px solid #666; padding-left: 0.8em; margin-left: 0; }
 """
 
-HTML_TEMPLATE = """\
-<!DOCTYPE html>
-<html>
-<head>
-<meta charset="utf-8">
-<style>{css}</style>
-</head>
-<body>
-{content}
-</body>
-</html>
-"""
+# Only the native PDF_ENGINEs need a full document (to carry the CSS and
+# <base>); WeasyPrint is given the bare article fragment.
+HTML_TEMPLATE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8">{head}</head>'
+    "<body>{content}</body></html>"
+)
+
+# Parse the stylesheet and load fonts once per process rather than per article.
+_FONT_CFG = FontConfiguration()
+_CSS = CSS(string=EREADER_CSS, font_config=_FONT_CFG)
 
 
 def wait_for_network(host="www.instapaper.com", timeout=300, interval=30):
@@ -112,6 +147,10 @@ def load_config():
     if missing:
         log.error("Missing env vars: %s. See config.example.env", ", ".join(missing))
         sys.exit(1)
+    pdf_engine = os.getenv("PDF_ENGINE", "weasyprint").lower()
+    if pdf_engine not in PDF_ENGINES:
+        log.error("Unknown PDF_ENGINE %r (expected one of: %s)", pdf_engine, ", ".join(PDF_ENGINES))
+        sys.exit(1)
     return {
         "consumer_key": os.environ["INSTAPAPER_CONSUMER_KEY"],
         "consumer_secret": os.environ["INSTAPAPER_CONSUMER_SECRET"],
@@ -126,16 +165,56 @@ def load_config():
                 )
             )
         ),
+        "token_cache": Path(
+            os.path.expanduser(
+                os.getenv(
+                    "TOKEN_CACHE", "~/.instapaper_to_remarkable_token.json"
+                )
+            )
+        ),
+        "pdf_engine": pdf_engine,
+        "bundle": os.getenv("BUNDLE", "").lower() in ("1", "true", "yes"),
+        # 0 keeps the processed log forever.
+        "processed_retention_days": int(os.getenv("PROCESSED_RETENTION_DAYS", "0")),
     }
 
 
 
+def _pooled_session(session):
+    """Mount a keep-alive connection pool with retries on `session`."""
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.5),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
 def instapaper_auth(config):
-    """Authenticate via Instapaper's xAuth flow and return an OAuth1Session."""
-    session = OAuth1Session(
+    """Authenticate via Instapaper's xAuth flow and return an OAuth1Session.
+
+    Access tokens are long-lived, so a token cached from a previous run is
+    tried first and the xAuth handshake only runs if Instapaper rejects it.
+    """
+    cached = load_token(config["token_cache"])
+    if cached:
+        session = _pooled_session(OAuth1Session(
+            config["consumer_key"],
+            client_secret=config["consumer_secret"],
+        ))
+        session.token = cached
+        resp = session.post(f"{INSTAPAPER_API}/api/1/account/verify_credentials")
+        if resp.status_code == 200:
+            return session
+        log.info("Cached Instapaper token rejected (%s), re-authenticating.", resp.status_code)
+
+    session = _pooled_session(OAuth1Session(
         config["consumer_key"],
         client_secret=config["consumer_secret"],
-    )
+    ))
     resp = session.post(
         f"{INSTAPAPER_API}/api/1/oauth/access_token",
         data={
@@ -155,12 +234,11 @@ def instapaper_auth(config):
     token = creds["oauth_token"][0]
     token_secret = creds["oauth_token_secret"][0]
 
-    return OAuth1Session(
-        config["consumer_key"],
-        client_secret=config["consumer_secret"],
-        resource_owner_key=token,
-        resource_owner_secret=token_secret,
-    )
+    # Sign further requests with the access token on the same session so the
+    # TLS connection opened for the handshake is reused for the API calls.
+    session.token = {"oauth_token": token, "oauth_token_secret": token_secret}
+    save_token(config["token_cache"], token, token_secret)
+    return session
 
 
 def fetch_bookmarks(session, limit=25):
@@ -172,25 +250,114 @@ def fetch_bookmarks(session, limit=25):
     if resp.status_code != 200:
         log.error("Failed to fetch bookmarks (%s): %s", resp.status_code, resp.text)
         return []
-    data = resp.json()
+    data = orjson.loads(resp.content)
     # The API returns a list of mixed objects; bookmarks have type "bookmark"
     return [item for item in data if item.get("type") == "bookmark"]
 
 
+_BODY = re.compile(r"<body[^>]*>(.*)</body>", re.IGNORECASE | re.DOTALL)
+
+
+def fetch_instapaper_text(session, bid):
+    """Return Instapaper's own extracted article HTML for a bookmark, or None.
+
+    bookmarks/get_text serves the already-cleaned text view, which saves
+    downloading the original page and running trafilatura on it.
+    """
+    try:
+        resp = session.post(
+            f"{INSTAPAPER_API}/api/1/bookmarks/get_text",
+            data={"bookmark_id": bid},
+            timeout=30,
+        )
+    except requests.RequestException as e:
+        log.debug("get_text error for bookmark %s: %s", bid, e)
+        return None
+    if not resp.ok:
+        log.debug("get_text got HTTP %d for bookmark %s", resp.status_code, bid)
+        return None
+    # The response is a complete HTML document; only the body is wanted.
+    m = _BODY.search(resp.text)
+    text = (m.group(1) if m else resp.text).strip()
+    return text or None
+
+
+def fetch_instapaper_texts(session, bids):
+    """Fetch get_text for several bookmarks concurrently. Returns {bid: html}."""
+    results = {}
+    if not bids:
+        return results
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCHES, len(bids))) as executor:
+        futures = {executor.submit(fetch_instapaper_text, session, bid): bid for bid in bids}
+        for future in as_completed(futures):
+            bid = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                # Only a fast path: fall back to fetching the original page.
+                log.warning("get_text error for bookmark %s: %s", bid, e)
+                continue
+            if text:
+                results[bid] = text
+    return results
+
+
 def load_processed(path):
     if path.exists():
-        return json.loads(path.read_text())
+        return orjson.loads(path.read_bytes())
     return {}
 
 
+def prune_processed(processed, days):
+    """Drop processed-log entries older than `days`.
+
+    Only safe for bookmarks that can't show up as unread again (e.g. they
+    get archived on the tablet side), since the log is the only dedup guard.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    return {bid: ts for bid, ts in processed.items() if ts >= cutoff}
+
+
 def save_processed(path, processed):
+    # Write to a sibling file and swap it in, so a crash mid-write can't
+    # truncate the log (it's the only thing preventing duplicate uploads).
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps(processed, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    os.replace(tmp, path)
+
+
+def load_token(path):
+    """Return a cached {oauth_token, oauth_token_secret} dict, or None."""
+    if not path.exists():
+        return None
+    try:
+        token = orjson.loads(path.read_bytes())
+        return {
+            "oauth_token": token["oauth_token"],
+            "oauth_token_secret": token["oauth_token_secret"],
+        }
+    except (ValueError, KeyError, TypeError):
+        log.warning("Ignoring unreadable token cache %s", path)
+        return None
+
+
+def save_token(path, token, secret):
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(processed, indent=2))
+    path.touch(mode=0o600, exist_ok=True)
+    os.chmod(path, 0o600)
+    path.write_bytes(orjson.dumps({"oauth_token": token, "oauth_token_secret": secret}))
+
+
+_FN_BAD = re.compile(r'[<>:"/\\|?*.]')
+_FN_WS = re.compile(r"\s+")
+_GRAPHIC = re.compile(r"<graphic\b|</graphic>")
+_H1_OPEN = re.compile(r"<h1[\s>]", re.IGNORECASE)
+_H1_CLOSE = re.compile(r"</h1>", re.IGNORECASE)
 
 
 def sanitize_filename(title):
-    name = re.sub(r'[<>:"/\\|?*.]', "", title)
-    name = re.sub(r"\s+", " ", name).strip()
+    name = _FN_WS.sub(" ", _FN_BAD.sub("", title)).strip()
     return name[:120] if name else "untitled"
 
 
@@ -241,43 +408,376 @@ def fetch_html(url):
     return trafilatura.fetch_url(url)
 
 
-def article_to_pdf(title, url, output_path):
-    """Fetch, extract, and convert an article to PDF. Returns True on success."""
-    html = fetch_html(url)
-    if not html:
-        log.warning("Could not fetch HTML for: %s", url)
-        return False
+_rs_extract_warned = False
+
 
-    content = trafilatura.extract(
-        html,
+def extract_content(html, include_images=True):
+    """Extract article HTML from a page, or None if nothing was found.
+
+    Uses rs-trafilatura when installed and falls back to Python trafilatura
+    for pages it can't handle (it returns None on e.g. forum layouts).
+    """
+    global _rs_extract_warned
+    options = dict(
         output_format="html",
-        include_images=True,
+        include_images=include_images,
         include_formatting=True,
     )
-    if not content:
-        log.warning("Could not extract content for: %s", url)
-        return False
+    if rs_extract is not None:
+        try:
+            content = rs_extract(html, **options)
+        except Exception as e:
+            log.warning("rs-trafilatura failed, falling back to trafilatura: %s", e)
+        else:
+            if isinstance(content, str):
+                if content:
+                    return content
+            elif content is not None and not _rs_extract_warned:
+                # Anything but a string or None means the install is broken
+                # (e.g. an API mismatch); say so once rather than silently
+                # degrading.
+                log.warning(
+                    "rs-trafilatura returned %s, falling back to trafilatura",
+                    type(content).__name__,
+                )
+                _rs_extract_warned = True
+    return trafilatura.extract(html, **options)
+
+
+def fetch_all(urls):
+    """Fetch several URLs concurrently. Returns {url: html}.
+
+    Failed fetches map to "" rather than None, so article_to_pdf treats them
+    as failed instead of downloading the page a second time.
+    """
+    results = {}
+    if not urls:
+        return results
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCHES, len(urls))) as executor:
+        futures = {executor.submit(fetch_html, url): url for url in set(urls)}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                results[url] = future.result() or ""
+            except Exception as e:
+                log.warning("Fetch error for %s: %s", url, e)
+                results[url] = ""
+    return results
+
+
+_image_session = None
+# Hosts whose image downloads recently timed out or refused the connection,
+# mapped to when that happened. Images are fetched one after another inside
+# ARTICLE_TIMEOUT, so one dead host must not cost a full timeout per image.
+_dead_image_hosts = {}
+IMAGE_FETCH_TIMEOUT = 10  # Same as WeasyPrint's default_url_fetcher.
+DEAD_HOST_TTL = 300
+
+
+def image_cache_fetcher(url):
+    """WeasyPrint url_fetcher that caches downloaded images on disk.
+
+    Articles from the same site tend to share logos and header images, so
+    a batch (and later runs) only download each one once. Non-HTTP URLs
+    (data:, file:) go through WeasyPrint's default fetcher.
+    """
+    global _image_session
+    if not url.startswith(("http://", "https://")):
+        return default_url_fetcher(url)
+
+    key = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+    path = IMAGE_CACHE_DIR / key
+    mime_path = path.with_suffix(".mime")
+    if path.exists():
+        os.utime(path)  # Mark as recently used for prune_image_cache.
+        mime_type = mime_path.read_text() if mime_path.exists() else None
+        return {
+            "string": path.read_bytes(),
+            "mime_type": mime_type or mimetypes.guess_type(url)[0],
+            "redirected_url": url,
+        }
+
+    host = urlparse(url).hostname
+    failed_at = _dead_image_hosts.get(host)
+    if failed_at is not None and time.monotonic() - failed_at < DEAD_HOST_TTL:
+        raise requests.ConnectionError(f"skipping image from unreachable host {host}")
+
+    if _image_session is None:
+        _image_session = requests.Session()
+        _image_session.headers["User-Agent"] = _FETCH_HEADERS["User-Agent"]
+    try:
+        resp = _image_session.get(url, timeout=IMAGE_FETCH_TIMEOUT)
+    except (requests.ConnectionError, requests.Timeout):
+        _dead_image_hosts[host] = time.monotonic()
+        raise
+    resp.raise_for_status()
+    mime_type = (
+        resp.headers.get("Content-Type", "").split(";")[0].strip()
+        or mimetypes.guess_type(url)[0]
+    )
+
+    # Several render workers may fetch the same image; write-then-rename so
+    # none of them ever reads a partial file. The MIME sidecar goes first so
+    # a cache hit on the data file always finds it complete.
+    IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    if mime_type:
+        tmp.write_text(mime_type)
+        os.replace(tmp, mime_path)
+    tmp.write_bytes(resp.content)
+    os.replace(tmp, path)
+    return {"string": resp.content, "mime_type": mime_type, "redirected_url": resp.url}
+
+
+def prune_image_cache(max_bytes=IMAGE_CACHE_MAX_BYTES):
+    """Delete least recently used cached images until under `max_bytes`.
+
+    Also removes temp files left behind by a fetch that was interrupted
+    (e.g. by ARTICLE_TIMEOUT) before it could rename them into place.
+    """
+    if not IMAGE_CACHE_DIR.is_dir():
+        return
+    cutoff = time.time() - ARTICLE_TIMEOUT
+    for p in IMAGE_CACHE_DIR.glob("*.tmp"):
+        try:
+            if p.stat().st_mtime < cutoff:
+                p.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+    files = [p for p in IMAGE_CACHE_DIR.iterdir() if not p.suffix]
+    files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    total = 0
+    for p in files:
+        total += p.stat().st_size
+        if total > max_bytes:
+            p.unlink(missing_ok=True)
+            p.with_suffix(".mime").unlink(missing_ok=True)
+
+
+def _find_chromium():
+    return next((p for p in map(shutil.which, _CHROMIUM_NAMES) if p), None)
+
+
+def _render_chromium(chromium, full_html):
+    with tempfile.TemporaryDirectory(prefix="instapaper_") as tmpdir:
+        src = Path(tmpdir) / "article.html"
+        out = Path(tmpdir) / "article.pdf"
+        src.write_text(full_html, encoding="utf-8")
+        cmd = [chromium, "--headless", "--disable-gpu"]
+        # Chromium refuses to start as root with its sandbox on; everywhere
+        # else keep it, since the page is untrusted third-party HTML.
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            cmd.append("--no-sandbox")
+        cmd += [
+            "--no-pdf-header-footer", "--print-to-pdf-no-header",
+            f"--print-to-pdf={out}", src.as_uri(),
+        ]
+        # The timeout only matters where _time_limit is a no-op (no SIGALRM).
+        subprocess.run(cmd, capture_output=True, timeout=ARTICLE_TIMEOUT)
+        if not out.exists() or not out.stat().st_size:
+            raise RuntimeError("chromium produced no PDF")
+        return out.read_bytes()
+
+
+def _render_wkhtmltopdf(full_html):
+    margins = []
+    for flag in ("-T", "-B", "-L", "-R"):
+        margins += [flag, "15mm"]
+    proc = subprocess.run(
+        ["wkhtmltopdf", "-q", "--encoding", "utf-8", "-s", "A5", *margins, "-", "-"],
+        input=full_html.encode("utf-8"), capture_output=True, timeout=ARTICLE_TIMEOUT,
+    )
+    # wkhtmltopdf exits non-zero when e.g. one image fails to load but still
+    # writes a usable PDF, so judge by the output rather than the exit code.
+    if not proc.stdout.startswith(b"%PDF"):
+        raise RuntimeError(f"wkhtmltopdf failed: {proc.stderr.decode(errors='replace').strip()}")
+    return proc.stdout
+
+
+def _resolve_engine(engine):
+    """Map PDF_ENGINE=auto to the renderer that will actually be used."""
+    if engine != "auto":
+        return engine
+    if _find_chromium():
+        return "chromium"
+    if shutil.which("wkhtmltopdf"):
+        return "wkhtmltopdf"
+    return "weasyprint"
+
+
+def render_pdf(content, base_url, engine="weasyprint"):
+    """Render article HTML to PDF bytes with the given PDF_ENGINE.
+
+    Native renderers are much faster than WeasyPrint on plain articles but
+    are optional; if the chosen one is missing or fails, WeasyPrint is used.
+    """
+    engine = _resolve_engine(engine)
+    if engine != "weasyprint":
+        # Native engines don't see the pre-parsed _CSS or base_url, so inline
+        # both into the document.
+        native_html = HTML_TEMPLATE.format(
+            head=f'<base href="{html_lib.escape(base_url)}"><style>{EREADER_CSS}</style>',
+            content=content,
+        )
+        try:
+            if engine == "chromium":
+                chromium = _find_chromium()
+                if chromium:
+                    return _render_chromium(chromium, native_html)
+            elif shutil.which("wkhtmltopdf"):
+                return _render_wkhtmltopdf(native_html)
+            log.warning("%s not found on PATH, falling back to WeasyPrint", engine)
+        except (OSError, RuntimeError, subprocess.SubprocessError) as e:
+            log.warning("%s render failed (%s), falling back to WeasyPrint", engine, e)
+
+    # No target: WeasyPrint returns the PDF as bytes, which go straight to
+    # rm_api without a round trip through a temp file. Its HTML5 parser
+    # supplies <html>/<body> itself, so no template is needed here.
+    return HTML(string=content, base_url=base_url, url_fetcher=image_cache_fetcher).write_pdf(
+        stylesheets=[_CSS], font_config=_FONT_CFG
+    )
+
+
+def _warmup(engine):
+    """Render-pool initializer: do one tiny render up front.
+
+    WeasyPrint imports much of itself and loads fonts lazily on the first
+    write_pdf, which otherwise lands on each worker's first article.
+    """
+    if _resolve_engine(engine) != "weasyprint":
+        return
+    try:
+        HTML(string="<p>x</p>").write_pdf(stylesheets=[_CSS], font_config=_FONT_CFG)
+    except Exception as e:
+        # A failing initializer would break the whole pool; the real render
+        # will report any problem with the article itself.
+        log.debug("WeasyPrint warmup failed: %s", e)
+
+
+class ArticleTimeout(BaseException):
+    """Raised when an article exceeds ARTICLE_TIMEOUT.
+
+    Derives from BaseException so the broad `except Exception` handlers
+    around fetching (and WeasyPrint's handling of url_fetcher errors) can't
+    swallow it.
+    """
+
+
+@contextmanager
+def _time_limit(seconds):
+    """Raise ArticleTimeout if the block runs longer than `seconds`.
+
+    Uses SIGALRM, so it's a no-op off the main thread or on platforms
+    without it. Render workers run tasks on their main thread.
+    """
+    if not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _raise(signum, frame):
+        raise ArticleTimeout()
+
+    previous = signal.signal(signal.SIGALRM, _raise)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def article_to_pdf(title, url, html=None, content=None, engine="weasyprint"):
+    """Fetch, extract, and convert an article to PDF. Returns the PDF bytes,
+    or None on failure or after ARTICLE_TIMEOUT seconds.
+
+    Pass `html` to skip the download when the page was already prefetched
+    ("" means the prefetch failed and is not retried), or `content`
+    (already-extracted article HTML, e.g. from Instapaper's get_text) to
+    skip both download and extraction. Runs in a worker process from
+    `main`, so it must stay a picklable module-level function.
+    """
+    log.info("Processing: %s", title)
+    try:
+        with _time_limit(ARTICLE_TIMEOUT):
+            return _article_to_pdf(title, url, html, content, engine)
+    except ArticleTimeout:
+        log.warning("Timed out rendering %s after %ds", url, ARTICLE_TIMEOUT)
+        return None
+
+
+def _article_to_pdf(title, url, html, content, engine):
+    if content is None:
+        if html is None:
+            html = fetch_html(url)
+        if not html:
+            log.warning("Could not fetch HTML for: %s", url)
+            return None
+
+        content = extract_content(html)
+        if not content:
+            log.warning("Could not extract content for: %s", url)
+            return None
 
     # Trafilatura outputs <graphic> tags instead of <img>; convert for WeasyPrint.
-    content = re.sub(r"<graphic\b", "<img", content)
-    content = re.sub(r"</graphic>", "", content)
+    content = _GRAPHIC.sub(
+        lambda m: "" if m.group(0) == "</graphic>" else "<img", content
+    )
 
     # Ensure title and URL appear at the top.
     url_tag = f'<p class="article-url">{html_lib.escape(url)}</p>'
-    if re.search(r"<h1[\s>]", content, re.IGNORECASE):
+    if _H1_OPEN.search(content):
         # Trafilatura included a title — insert URL line after it.
-        content = re.sub(
-            r"(</h1>)", rf"\1\n{url_tag}", content, count=1, flags=re.IGNORECASE
+        content = _H1_CLOSE.sub(
+            lambda m: f"{m.group(0)}\n{url_tag}", content, count=1
         )
     else:
         content = f"<h1>{html_lib.escape(title)}</h1>\n{url_tag}\n{content}"
 
-    full_html = HTML_TEMPLATE.format(
-        css=EREADER_CSS,
-        content=content,
-    )
-    HTML(string=full_html, base_url=url).write_pdf(str(output_path))
-    return True
+    return render_pdf(content, url, engine)
+
+
+def _cached_pdf_path(bid):
+    return CACHE_DIR / f"{bid}.pdf"
+
+
+def load_cached_pdf(bid, max_age=PDF_CACHE_MAX_AGE):
+    """Return a previously rendered, not yet uploaded PDF, or None."""
+    path = _cached_pdf_path(bid)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    if st.st_size and time.time() - st.st_mtime < max_age:
+        return path.read_bytes()
+    return None
+
+
+def cache_pdf(bid, pdf_bytes):
+    """Keep a rendered PDF until its upload succeeds, so a failed run
+    doesn't have to render it again."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _cached_pdf_path(bid)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(pdf_bytes)
+    os.replace(tmp, path)
+
+
+def prune_pdf_cache(max_age=PDF_CACHE_MAX_AGE):
+    """Delete cached PDFs (and stray temp files) older than `max_age`.
+
+    A PDF whose upload failed is only removed by a later successful upload;
+    if the bookmark is archived in the meantime it would otherwise stay
+    forever.
+    """
+    if not CACHE_DIR.is_dir():
+        return
+    cutoff = time.time() - max_age
+    for p in (*CACHE_DIR.glob("*.pdf"), *CACHE_DIR.glob("*.tmp")):
+        try:
+            if p.stat().st_mtime < cutoff:
+                p.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
 
 
 def _get_rm_device_token():
@@ -290,15 +790,20 @@ def _get_rm_device_token():
     return None
 
 
-def upload_to_remarkable(pdf_path, title, folder):
-    """Upload a PDF to Remarkable via rm_api. Returns True on success."""
+def connect_remarkable(folder, create=True):
+    """Connect to Remarkable via rm_api and find (or create) `folder`.
+
+    Returns (api, folder collection), or None if the connection failed or
+    the folder doesn't exist and `create` is False. Callers keep the client
+    for the whole run so authentication and the metadata sync happen once.
+    """
     from rm_api import API
-    from rm_api.models import Document, DocumentCollection
+    from rm_api.models import DocumentCollection
 
     device_token = _get_rm_device_token()
     if not device_token:
         log.error("No rmapi device token found in ~/Library/Application Support/rmapi/rmapi.conf")
-        return False
+        return None
 
     token_file = Path.home() / ".rm_api_device_token"
     token_file.write_text(device_token)
@@ -309,7 +814,7 @@ def upload_to_remarkable(pdf_path, title, folder):
         api = API(token_file_path=str(token_file), sync_file_path=sync_dir, log_file=os.devnull)
         if api.offline_mode:
             log.error("rm_api: offline — cannot upload")
-            return False
+            return None
 
         api.get_documents()
 
@@ -320,19 +825,90 @@ def upload_to_remarkable(pdf_path, title, folder):
             None,
         )
         if target is None:
+            if not create:
+                log.error("Remarkable folder /%s not found", folder_name)
+                return None
             target = DocumentCollection.create(api, folder_name, parent=None)
             api.upload(target)
+        return api, target
+
+    except Exception:
+        log.exception("rm_api connection error")
+        return None
+
+
+def upload_to_remarkable(api, target, pdf_bytes, title):
+    """Upload a PDF into an already-resolved folder. Returns True on success."""
+    from rm_api.models import Document
 
-        pdf_bytes = Path(pdf_path).read_bytes()
+    try:
         doc = Document.new_pdf(api=api, name=title, pdf_data=pdf_bytes, parent=target.uuid)
         api.upload(doc)
         return True
-
     except Exception:
         log.exception("rm_api upload error")
         return False
 
 
+def bundle_pdfs(pdfs):
+    """Concatenate [(title, pdf_bytes), ...] into one PDF, with an outline
+    entry per article. Returns the merged PDF bytes."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for title, pdf_bytes in pdfs:
+        writer.append(io.BytesIO(pdf_bytes), outline_item=title)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def uploader(upload_q, folder, uploaded):
+    """Upload thread: upload (bids, title, pdf_bytes) items from `upload_q`
+    until a None sentinel arrives.
+
+    `bids` is a tuple of the bookmark ids contained in the PDF (more than
+    one for a BUNDLE upload). Connects to Remarkable once, while the first
+    articles are still rendering, and adds the bookmark ids of each
+    successful upload to `uploaded`. Always drains the queue, even if the
+    connection failed, so producers blocked on the bounded queue can't hang.
+    """
+    try:
+        conn = connect_remarkable(folder)
+    except Exception:
+        log.exception("rm_api connection error")
+        conn = None
+    while True:
+        item = upload_q.get()
+        if item is None:
+            return
+        bids, title, pdf_bytes = item
+        try:
+            if conn is not None and upload_to_remarkable(*conn, pdf_bytes, title):
+                uploaded.update(bids)
+                for bid in bids:
+                    _cached_pdf_path(bid).unlink(missing_ok=True)
+                log.info("Uploaded: %s", title)
+            else:
+                log.error("Upload failed, will retry next run: %s", title)
+        except Exception:
+            log.exception("Error uploading %s", title)
+
+
+def _enqueue(upload_q, upload_thread, item):
+    """Put `item` on the upload queue without blocking forever if the
+    upload thread has died. Returns False if the item was dropped."""
+    while upload_thread.is_alive():
+        try:
+            upload_q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    if item is not None:
+        log.error("Upload thread is not running, will retry next run: %s", item[1])
+    return False
+
+
 def main():
     config = load_config()
 
@@ -346,40 +922,120 @@ def main():
         return
 
     processed = load_processed(config["processed_log"])
-    new_bookmarks = [b for b in bookmarks if str(b["bookmark_id"]) not in processed]
+    processed_ids = {int(bid) for bid in processed}
+    new_bookmarks = [b for b in bookmarks if b["bookmark_id"] not in processed_ids]
     if not new_bookmarks:
         log.info("No new bookmarks to process.")
         return
 
     log.info("Processing %d new bookmark(s)...", len(new_bookmarks))
-    tmpdir = tempfile.mkdtemp(prefix="instapaper_")
+    jobs = []
+    cached = []
+    for bookmark in new_bookmarks:
+        bid = str(bookmark["bookmark_id"])
+        title = bookmark.get("title", "Untitled")
+        url = bookmark.get("url", "")
+        pdf_bytes = load_cached_pdf(bid)
+        if pdf_bytes:
+            log.info("Using cached PDF: %s", title)
+            cached.append(((bid,), title, pdf_bytes))
+        else:
+            jobs.append((bid, title, url))
+
+    # Prefer Instapaper's text view, except for sites we hold a cookie file
+    # for: there the authenticated original is better than Instapaper's copy,
+    # which is often cut off at the paywall.
+    text_bids = [bid for bid, _, url in jobs if _cookie_jar_for_url(url) is None]
+    texts = fetch_instapaper_texts(session, text_bids)
+    log.info("Got Instapaper text for %d of %d bookmark(s).", len(texts), len(text_bids))
+    pages = fetch_all([url for bid, _, url in jobs if url and bid not in texts])
+
+    # Uploads run on their own thread so rm_api network I/O overlaps with
+    # rendering. The bounded queue keeps finished PDFs from piling up in
+    # memory if uploads fall behind.
+    uploaded = set()
+    upload_q = queue.Queue(maxsize=4)
+    upload_thread = threading.Thread(
+        target=uploader,
+        args=(upload_q, config["remarkable_folder"], uploaded),
+        daemon=True,
+    )
+
+    # In BUNDLE mode articles are collected and uploaded as a single PDF.
+    bundle = [] if config["bundle"] else None
 
     try:
-        for bookmark in new_bookmarks:
-            bid = str(bookmark["bookmark_id"])
-            title = bookmark.get("title", "Untitled")
-            url = bookmark.get("url", "")
-            log.info("Processing: %s", title)
+        with ProcessPoolExecutor(
+            max_workers=MAX_WORKERS,
+            initializer=_warmup,
+            initargs=(config["pdf_engine"],),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    article_to_pdf, title, url, pages.get(url), texts.get(bid),
+                    config["pdf_engine"],
+                ): (bid, title)
+                for bid, title, url in jobs
+            }
+            # Start uploading only once the submits above have forked the
+            # workers: forking while another thread holds locks (rm_api's
+            # connection) can deadlock the children.
+            upload_thread.start()
+            for item in cached:
+                if bundle is not None:
+                    bundle.append(item)
+                else:
+                    _enqueue(upload_q, upload_thread, item)
+            for future in as_completed(futures):
+                bid, title = futures[future]
+                try:
+                    pdf_bytes = future.result()
+                    if not pdf_bytes:
+                        continue
 
-            filename = sanitize_filename(title) + ".pdf"
-            pdf_path = os.path.join(tmpdir, filename)
+                    log.info("PDF size: %.1f MB — %s", len(pdf_bytes) / 1024**2, title)
+                    try:
+                        cache_pdf(bid, pdf_bytes)
+                    except OSError as e:
+                        # The cache only saves a re-render next run; still upload.
+                        log.warning("Could not cache PDF for %s: %s", title, e)
+                    if bundle is not None:
+                        bundle.append(((bid,), title, pdf_bytes))
+                    else:
+                        _enqueue(upload_q, upload_thread, ((bid,), title, pdf_bytes))
+                except Exception:
+                    log.exception("Error processing bookmark %s (%s)", bid, title)
 
+        if bundle:
+            # Keep the Instapaper list order rather than render-completion order.
+            order = {str(b["bookmark_id"]): i for i, b in enumerate(new_bookmarks)}
+            bundle.sort(key=lambda item: order[item[0][0]])
+            # Include the time: launchd runs twice a day, and both runs
+            # would otherwise produce a document with the same name.
+            name = f"Instapaper-{datetime.now():%Y-%m-%d %H%M}"
             try:
-                if not article_to_pdf(title, url, pdf_path):
-                    continue
-
-                size_mb = Path(pdf_path).stat().st_size / 1024**2
-                log.info("PDF size: %.1f MB — %s", size_mb, title)
-                if upload_to_remarkable(pdf_path, title, config["remarkable_folder"]):
-                    processed[bid] = datetime.now(timezone.utc).isoformat()
-                    save_processed(config["processed_log"], processed)
-                    log.info("Uploaded: %s", title)
-                else:
-                    log.error("Upload failed, will retry next run: %s", title)
+                pdf_bytes = bundle_pdfs([(title, pdf) for _, title, pdf in bundle])
             except Exception:
-                log.exception("Error processing bookmark %s (%s)", bid, title)
+                # One unreadable PDF shouldn't block the whole batch run
+                # after run; upload the articles individually instead.
+                log.exception("Could not bundle PDFs, uploading articles individually")
+                for item in bundle:
+                    _enqueue(upload_q, upload_thread, item)
+            else:
+                log.info("Bundled %d article(s) into %s (%.1f MB)",
+                         len(bundle), name, len(pdf_bytes) / 1024**2)
+                bids = tuple(bid for (bid,), _, _ in bundle)
+                _enqueue(upload_q, upload_thread, (bids, name, pdf_bytes))
     finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        if upload_thread.is_alive() and _enqueue(upload_q, upload_thread, None):
+            upload_thread.join()
+        for bid in uploaded:
+            processed[bid] = datetime.now(timezone.utc).isoformat()
+        if config["processed_retention_days"]:
+            processed = prune_processed(processed, config["processed_retention_days"])
+        save_processed(config["processed_log"], processed)
+        prune_image_cache()
+        prune_pdf_cache()
 
     log.info("Done. Processed %d bookmark(s).", len(processed))
 